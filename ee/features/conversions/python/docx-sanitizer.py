@@ -15,6 +15,10 @@ Usage:
     python docx-sanitizer.py input.docx [output.docx]
     python docx-sanitizer.py --mode rtl -v input.docx output.docx
     python docx-sanitizer.py --mode all -v input.docx output.docx
+    python docx-sanitizer.py --check-rtl --also-sanitize input.docx output.docx
+    python docx-sanitizer.py --batch files.txt -j 8
+    python docx-sanitizer.py --stdio < input.docx > output.docx
+    printf 'a.docx\\0a-out.docx\\0' | python docx-sanitizer.py --server
 
 Modes:
     rtl  — RTL compat fix + glossary removal only
@@ -22,78 +26,101 @@ Modes:
     all  — All fixes (default)
 
 If output is omitted, the input file is overwritten in place.
+
+Rewritten parts are deflated with ISA-L when the optional `isal` package is
+installed, and with zipfile's zlib otherwise.
 """
 
 import sys
 import os
+import io
 import re
 import logging
+import mmap
 import zipfile
 import tempfile
 import argparse
+import concurrent.futures
+import contextlib
+import functools
+import posixpath
 import shutil
+import struct
+import zlib
 import xml.etree.ElementTree as ET
 
+try:
+    from isal import isal_zlib
+except ImportError:
+    isal_zlib = None
+
 log = logging.getLogger("docx-sanitizer")
 
 W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
 
+# document.xml parts above this size are unwrapped straight into the output's
+# compressor instead of being rebuilt as one new buffer.
+LARGE_DOCUMENT_SIZE = 20 * 1024 * 1024
 
-def has_rtl_content(doc_content: str) -> bool:
-    """Check whether document.xml contains RTL / complex-script markers."""
-    return '<w:rtl/>' in doc_content or '<w:bidi/>' in doc_content
+# Slices of a streamed part are gathered into buffers of about this size
+# before compressing, so each crc32()/compress() call gets a useful amount.
+COALESCE_SIZE = 1 << 20
 
+# ISA-L's strongest level; XML parts compress well even at low levels.
+ISAL_LEVEL = 3
 
-def downgrade_compat_mode(content: str) -> tuple:
-    """Downgrade compatibilityMode from 15 to 14 in settings.xml content."""
-    new_content = re.sub(
-        r'(<w:compatSetting\b'
-        r'(?=[^>]*\bw:name="compatibilityMode")'
-        r'(?=[^>]*\bw:uri="http://schemas\.microsoft\.com/office/word")'
-        r'[^>]*\bw:val=")15(")',
-        r'\g<1>14\2',
-        content,
-    )
+
+def has_rtl_content(doc_data: bytes) -> bool:
+    """Check whether raw document.xml bytes contain RTL / complex-script markers."""
+    return b'<w:rtl/>' in doc_data or b'<w:bidi/>' in doc_data
+
+
+_COMPAT_RE = re.compile(
+    rb'(<w:compatSetting\b'
+    rb'(?=[^>]*\bw:name="compatibilityMode")'
+    rb'(?=[^>]*\bw:uri="http://schemas\.microsoft\.com/office/word")'
+    rb'[^>]*\bw:val=")15(")'
+)
+
+
+def downgrade_compat_mode(content: bytes) -> tuple:
+    """Downgrade compatibilityMode from 15 to 14 in raw settings.xml bytes."""
+    new_content = _COMPAT_RE.sub(rb'\g<1>14\2', content)
     changed = new_content != content
     return new_content, changed
 
 
-def remove_glossary(tmp_dir: str) -> bool:
-    """Remove word/glossary/ directory and clean up its references."""
-    glossary_dir = os.path.join(tmp_dir, 'word', 'glossary')
-    if not os.path.isdir(glossary_dir):
+# Parts that reference glossary/, with the pattern matching each reference.
+_GLOSSARY_REFERENCES = (
+    ('word/_rels/document.xml.rels',
+     re.compile(rb'<Relationship[^>]*Target="glossary/[^"]*"[^>]*/>\s*')),
+    ('[Content_Types].xml',
+     re.compile(rb'<Override[^>]*PartName="/word/glossary/[^"]*"[^>]*/>\s*')),
+)
+
+
+def remove_glossary(zin: zipfile.ZipFile, parts: dict) -> bool:
+    """Drop word/glossary/ parts and clean up their references.
+
+    Edits are recorded in *parts* (part name → new bytes, or None to drop).
+    The referencing parts are only read when a glossary is actually present.
+    """
+    glossary = [n for n in zin.namelist() if n.startswith('word/glossary/')]
+    if not glossary:
         return False
 
-    shutil.rmtree(glossary_dir)
+    for name in glossary:
+        parts[name] = None
     log.info("Removed word/glossary/ directory")
 
-    rels_path = os.path.join(tmp_dir, 'word', '_rels', 'document.xml.rels')
-    if os.path.exists(rels_path):
-        with open(rels_path, 'r', encoding='utf-8') as f:
-            rels_content = f.read()
-        new_rels = re.sub(
-            r'<Relationship[^>]*Target="glossary/[^"]*"[^>]*/>\s*',
-            '',
-            rels_content,
-        )
-        if new_rels != rels_content:
-            with open(rels_path, 'w', encoding='utf-8') as f:
-                f.write(new_rels)
-            log.info("Removed glossary relationship from document.xml.rels")
-
-    ct_path = os.path.join(tmp_dir, '[Content_Types].xml')
-    if os.path.exists(ct_path):
-        with open(ct_path, 'r', encoding='utf-8') as f:
-            ct_content = f.read()
-        new_ct = re.sub(
-            r'<Override[^>]*PartName="/word/glossary/[^"]*"[^>]*/>\s*',
-            '',
-            ct_content,
-        )
-        if new_ct != ct_content:
-            with open(ct_path, 'w', encoding='utf-8') as f:
-                f.write(new_ct)
-            log.info("Removed glossary overrides from [Content_Types].xml")
+    for name, pattern in _GLOSSARY_REFERENCES:
+        if name not in zin.NameToInfo:
+            continue
+        data = zin.read(name)
+        new_data, n = pattern.subn(b'', data)
+        if n:
+            parts[name] = new_data
+            log.info("Removed glossary reference(s) from %s", name)
 
     return True
 
@@ -105,10 +132,12 @@ NUMPAGES_FIELD_RE = re.compile(
 
 _NUMPAGES_TEXT_RE = re.compile(r'\b(?:numpages|sectionpages)\b', re.IGNORECASE)
 
+_HF_PART_RE = re.compile(r'word/(?:header|footer)[^/]*\.xml')
 
-def _register_all_namespaces(path: str):
-    """Register every namespace prefix declared in *path* so ET.write() preserves them."""
-    for _event, ns in ET.iterparse(path, events=['start-ns']):
+
+def _register_all_namespaces(data: bytes):
+    """Register every namespace prefix declared in *data* so ET.write() preserves them."""
+    for _event, ns in ET.iterparse(io.BytesIO(data), events=['start-ns']):
         prefix, uri = ns
         try:
             ET.register_namespace(prefix, uri)
@@ -116,7 +145,7 @@ def _register_all_namespaces(path: str):
             pass
 
 
-def strip_numpages_fields_in_hf(tmp_dir: str) -> int:
+def strip_numpages_fields_in_hf(zin: zipfile.ZipFile, parts: dict) -> int:
     """Remove paragraphs in headers/footers that contain NUMPAGES-based fields.
 
     Nested IF fields that reference NUMPAGES inside headers/footers cause an
@@ -130,174 +159,474 @@ def strip_numpages_fields_in_hf(tmp_dir: str) -> int:
     broken.  Uses proper XML tree parsing instead of regex to safely handle
     arbitrarily nested paragraph-property structures.
     """
-    import glob as _glob
-
     count = 0
-    word_dir = os.path.join(tmp_dir, 'word')
-    for pattern in ('header*.xml', 'footer*.xml'):
-        for path in _glob.glob(os.path.join(word_dir, pattern)):
-            with open(path, 'r', encoding='utf-8') as f:
-                raw = f.read()
-
-            if not NUMPAGES_FIELD_RE.search(raw):
+    for name in zin.namelist():
+        if not _HF_PART_RE.fullmatch(name):
+            continue
+
+        data = zin.read(name)
+        if not NUMPAGES_FIELD_RE.search(data.decode('utf-8')):
+            continue
+
+        _register_all_namespaces(data)
+        tree = ET.ElementTree(ET.fromstring(data))
+        root = tree.getroot()
+        modified = False
+
+        for p_elem in root.iter(f'{{{W_NS}}}p'):
+            has_numpages = False
+            for instr in p_elem.iter(f'{{{W_NS}}}instrText'):
+                if instr.text and _NUMPAGES_TEXT_RE.search(instr.text):
+                    has_numpages = True
+                    break
+            if not has_numpages:
                 continue
 
-            _register_all_namespaces(path)
-            tree = ET.parse(path)
-            root = tree.getroot()
-            modified = False
-
-            for p_elem in root.iter(f'{{{W_NS}}}p'):
-                has_numpages = False
-                for instr in p_elem.iter(f'{{{W_NS}}}instrText'):
-                    if instr.text and _NUMPAGES_TEXT_RE.search(instr.text):
-                        has_numpages = True
-                        break
-                if not has_numpages:
-                    continue
-
-                count += 1
-                modified = True
-
-                ppr = p_elem.find(f'{{{W_NS}}}pPr')
-                for child in list(p_elem):
-                    p_elem.remove(child)
-
-                if ppr is not None:
-                    p_elem.insert(0, ppr)
-                else:
-                    ET.SubElement(p_elem, f'{{{W_NS}}}pPr')
+            count += 1
+            modified = True
 
-            if modified:
-                tree.write(path, xml_declaration=True, encoding='UTF-8')
-                log.info("Stripped NUMPAGES field paragraph(s) from %s",
-                         os.path.basename(path))
+            ppr = p_elem.find(f'{{{W_NS}}}pPr')
+            for child in list(p_elem):
+                p_elem.remove(child)
+
+            if ppr is not None:
+                p_elem.insert(0, ppr)
+            else:
+                ET.SubElement(p_elem, f'{{{W_NS}}}pPr')
+
+        if modified:
+            buf = io.BytesIO()
+            tree.write(buf, xml_declaration=True, encoding='UTF-8')
+            parts[name] = buf.getvalue()
+            log.info("Stripped NUMPAGES field paragraph(s) from %s",
+                     posixpath.basename(name))
 
     return count
 
 
-def unwrap_sdt(content: str) -> tuple:
-    """Replace <w:sdt>...<w:sdtContent>X</w:sdtContent></w:sdt> with X."""
+_SDT_OPEN = b'<w:sdt><w:sdtPr>'
+_SDT_BODY = b'</w:sdtPr><w:sdtContent>'
+_SDT_CLOSE = b'</w:sdtContent></w:sdt>'
+
+_BODY_OPEN = b'<w:body>'
+_BODY_CLOSE = b'</w:body>'
+
+
+def _sdt_pass(content: bytes, write=None) -> tuple:
+    """Run one unwrap pass over *content*, feeding the result to *write*.
+
+    Each surviving slice of *content* is passed to *write* as a memoryview as
+    soon as it is found, so the pass itself keeps nothing per block; with no
+    *write* it only counts.  Returns the number of blocks unwrapped, whether
+    an unwrapped block's content still holds an SDT opener (i.e. whether a
+    further pass may find nested blocks), and the number of bytes removed.
+    Nothing is written when no block is unwrapped.
+
+    Each block runs from <w:sdt><w:sdtPr> to the first following
+    sdtPr/sdtContent boundary, and from there to the first following
+    </w:sdtContent></w:sdt>.  Plain find() calls keep this linear: once a
+    block is left unterminated, no later block can be complete either, so the
+    scan stops instead of retrying from every remaining <w:sdt>.
+
+    SDTs only occur inside <w:body>, so when it is present the scan is
+    limited to that region rather than the prologue and trailing markup.
+    """
+    lo = content.find(_BODY_OPEN)
+    hi = content.rfind(_BODY_CLOSE)
+    if lo < 0 or hi < lo:
+        lo, hi = 0, len(content)
+
+    view = memoryview(content)
     count = 0
-    while '<w:sdt>' in content:
-        old = content
-        content = re.sub(
-            r'<w:sdt><w:sdtPr>.*?</w:sdtPr><w:sdtContent>(.*?)</w:sdtContent></w:sdt>',
-            r'\1',
-            content,
-            count=1,
-            flags=re.DOTALL,
-        )
-        if content == old:
+    nested = False
+    removed = 0
+    pos = 0
+    open_at = content.find(_SDT_OPEN, lo, hi)
+    while open_at >= 0:
+        body_at = content.find(_SDT_BODY, open_at + len(_SDT_OPEN), hi)
+        if body_at < 0:
+            break
+        body_at += len(_SDT_BODY)
+        close_at = content.find(_SDT_CLOSE, body_at, hi)
+        if close_at < 0:
             break
+        if write:
+            write(view[pos:open_at])
+            write(view[body_at:close_at])
+        pos = close_at + len(_SDT_CLOSE)
         count += 1
+        removed += body_at - open_at + len(_SDT_CLOSE)
+        # Searching from the content start finds both nested openers and,
+        # when there are none, the next block's opener in one go.
+        open_at = content.find(_SDT_OPEN, body_at, hi)
+        if 0 <= open_at < pos:
+            nested = True
+            open_at = content.find(_SDT_OPEN, pos, hi)
+    if write and count:
+        write(view[pos:])
+    return count, nested, removed
+
+
+def unwrap_sdt(content: bytes) -> tuple:
+    """Replace <w:sdt>...<w:sdtContent>X</w:sdtContent></w:sdt> with X in raw bytes.
+
+    Each pass unwraps every non-overlapping block in one linear scan; further
+    passes are only needed for nested SDTs.  The result is a bytearray when
+    anything was unwrapped, or *content* itself otherwise.
+    """
+    count = 0
+    while True:
+        out = bytearray()
+        n, _nested, _removed = _sdt_pass(content, out.extend)
+        if not n:
+            break
+        content = out
+        count += n
     return content, count
 
 
-def repackage_docx(tmp_dir: str, output_path: str):
-    """Repackage extracted DOCX with [Content_Types].xml first."""
-    entries = []
-    ct_entry = None
-    for root, _dirs, files in os.walk(tmp_dir):
-        for file in files:
-            fp = os.path.join(root, file)
-            arc = os.path.relpath(fp, tmp_dir)
-            if arc == '[Content_Types].xml':
-                ct_entry = (fp, arc)
+def unwrap_sdt_streaming(content: bytes) -> tuple:
+    """Like unwrap_sdt(), but without building the unwrapped document.
+
+    Returns (data, count, removed bytes).  A count-only pass runs first; when
+    nothing is nested, *data* is a callable that replays the pass into the
+    write function it is given, so _write_part() can compress a large
+    document.xml straight from *content*.  Nested SDTs need the joined result
+    for the next pass, so they fall back to unwrap_sdt().
+    """
+    count, nested, removed = _sdt_pass(content)
+    if nested:
+        new_content, count = unwrap_sdt(content)
+        return new_content, count, len(content) - len(new_content)
+    return functools.partial(_sdt_pass, content), count, removed
+
+
+def _copy_info(info: zipfile.ZipInfo) -> zipfile.ZipInfo:
+    """Fresh ZipInfo carrying over the metadata worth preserving from *info*."""
+    new_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+    new_info.compress_type = info.compress_type
+    new_info.external_attr = info.external_attr
+    new_info.create_system = info.create_system
+    new_info.comment = info.comment
+    return new_info
+
+
+def _raw_member(src, info: zipfile.ZipInfo) -> memoryview:
+    """Return a zero-copy view of the still-compressed bytes of *info* in *src*.
+
+    *src* is any buffer holding the whole input archive, e.g. an mmap of it.
+    """
+    fheader = struct.unpack_from(zipfile.structFileHeader, src, info.header_offset)
+    start = (info.header_offset + zipfile.sizeFileHeader
+             + fheader[zipfile._FH_FILENAME_LENGTH]
+             + fheader[zipfile._FH_EXTRA_FIELD_LENGTH])
+    end = start + info.compress_size
+    if end > len(src):
+        raise zipfile.BadZipFile(f"Truncated ZIP entry: {info.filename}")
+    return memoryview(src)[start:end]
+
+
+def _write_raw(zout: zipfile.ZipFile, info: zipfile.ZipInfo, raw):
+    """Append already-compressed *raw* bytes to *zout* as member *info*.
+
+    zipfile has no public raw-write API, so this writes the local header and
+    registers the entry for the central directory the same way
+    ZipFile.writestr() does.  *info* must carry the final CRC and sizes.
+    """
+    with zout._lock:
+        if zout._seekable:
+            zout.fp.seek(zout.start_dir)
+        info.header_offset = zout.fp.tell()
+        zout._writecheck(info)
+        zout._didModify = True
+        zout.fp.write(info.FileHeader())
+        zout.fp.write(raw)
+        zout.start_dir = zout.fp.tell()
+        zout.filelist.append(info)
+        zout.NameToInfo[info.filename] = info
+
+
+def _copy_raw(src, info: zipfile.ZipInfo, zout: zipfile.ZipFile):
+    """Copy *info* from the input archive buffer *src* into *zout* as-is."""
+    new_info = _copy_info(info)
+    new_info.CRC = info.CRC
+    new_info.compress_size = info.compress_size
+    new_info.file_size = info.file_size
+    with _raw_member(src, info) as raw:
+        _write_raw(zout, new_info, raw)
+
+
+def _write_part(zout: zipfile.ZipFile, info: zipfile.ZipInfo, data):
+    """Compress and write a modified part, using ISA-L's deflate when installed.
+
+    *data* is the part's bytes, or a callable that feeds the part, in order,
+    to the write function it is given (see unwrap_sdt_streaming()).  The CRC
+    and sizes are computed up front so the local header is written once,
+    final, rather than patched after zipfile streams the data.
+    """
+    new_info = _copy_info(info)
+    deflate = isal_zlib or zlib
+
+    if new_info.compress_type == zipfile.ZIP_STORED:
+        compressor = None
+    elif new_info.compress_type == zipfile.ZIP_DEFLATED:
+        level = ISAL_LEVEL if isal_zlib else zlib.Z_DEFAULT_COMPRESSION
+        compressor = deflate.compressobj(level, deflate.DEFLATED, -15)
+    else:
+        with zout.open(new_info, 'w') as dest:
+            if callable(data):
+                data(dest.write)
             else:
-                entries.append((fp, arc))
+                dest.write(data)
+        return
+
+    crc = 0
+    size = 0
+    compressed = []
+
+    def feed(chunk):
+        nonlocal crc, size
+        crc = deflate.crc32(chunk, crc)
+        size += len(chunk)
+        if compressor:
+            compressed.append(compressor.compress(chunk))
+        else:
+            compressed.append(bytes(chunk))
+
+    if callable(data):
+        pending = bytearray()
+
+        def write(chunk):
+            nonlocal pending
+            pending += chunk
+            if len(pending) >= COALESCE_SIZE:
+                feed(pending)
+                pending = bytearray()
+
+        data(write)
+        if pending:
+            feed(pending)
+    else:
+        feed(data)
+
+    if compressor:
+        compressed.append(compressor.flush())
+    raw = b''.join(compressed)
+    new_info.CRC = crc
+    new_info.file_size = size
+    new_info.compress_size = len(raw)
+    _write_raw(zout, new_info, raw)
+
+
+def build_manifest(zin: zipfile.ZipFile, parts: dict) -> list:
+    """List the output members as (ZipInfo, data) pairs, [Content_Types].xml first.
+
+    *data* is the replacement bytes from *parts*, or None for a member that is
+    copied through unchanged.  Directory entries and parts mapped to None in
+    *parts* are left out.
+    """
+    manifest = []
+    ct_entry = None
+    for info in zin.infolist():
+        if info.is_dir():
+            continue
+        data = parts.get(info.filename)
+        if data is None and info.filename in parts:
+            continue
+        if info.filename == '[Content_Types].xml':
+            ct_entry = (info, data)
+        else:
+            manifest.append((info, data))
     if ct_entry:
-        entries.insert(0, ct_entry)
+        manifest.insert(0, ct_entry)
+    return manifest
+
+
+def repackage_docx(manifest: list, src, output):
+    """Write the members listed in *manifest* to *output*, in order.
+
+    *output* is a path or a writable binary file object.
+
+    Replaced parts are recompressed; every other member is copied through as
+    raw compressed bytes straight from *src*, the buffer holding the input
+    archive.
+    """
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as zout:
+        for info, data in manifest:
+            if data is None:
+                _copy_raw(src, info, zout)
+            else:
+                _write_part(zout, info, data)
 
-    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as z:
-        for fp, arc in entries:
-            z.write(fp, arc)
 
+def collect_fixes(zin: zipfile.ZipFile, doc_data: bytes, mode: str = 'all') -> dict:
+    """Work out every fix *mode* calls for, without writing anything.
+
+    Returns a map of part name → replacement bytes (None drops the part);
+    an empty map means the archive needs no changes.
+    """
+    parts = {}
+
+    # --- RTL compat fixes (glossary removal + compat mode downgrade) ---
+    if mode in ('rtl', 'all'):
+        remove_glossary(zin, parts)
+
+        if has_rtl_content(doc_data):
+            log.info("RTL content detected — checking compatibilityMode")
+            settings_name = 'word/settings.xml'
+            if settings_name in zin.NameToInfo:
+                settings_data = zin.read(settings_name)
+                new_settings, changed = downgrade_compat_mode(settings_data)
+                if changed:
+                    parts[settings_name] = new_settings
+                    log.info("Downgraded compatibilityMode 15 → 14")
+                else:
+                    log.info("compatibilityMode is not 15 — no change needed")
+            else:
+                log.info("No word/settings.xml found — skipping compat fix")
+        else:
+            log.info("No RTL content detected — skipping compat downgrade")
+
+    # --- Header/footer NUMPAGES field fix ---
+    if mode == 'all':
+        nf_count = strip_numpages_fields_in_hf(zin, parts)
+        if nf_count:
+            log.info("Stripped %d NUMPAGES field paragraph(s) from headers/footers",
+                     nf_count)
+        else:
+            log.info("No NUMPAGES fields found in headers/footers")
+
+    # --- SDT unwrap ---
+    if mode in ('sdt', 'all'):
+        if len(doc_data) > LARGE_DOCUMENT_SIZE:
+            new_doc, sdt_count, removed = unwrap_sdt_streaming(doc_data)
+        else:
+            new_doc, sdt_count = unwrap_sdt(doc_data)
+            removed = len(doc_data) - len(new_doc)
+        if sdt_count:
+            log.info("Unwrapped %d <w:sdt> block(s) (removed %d bytes)",
+                     sdt_count, removed)
+            parts['word/document.xml'] = new_doc
+        else:
+            log.info("No <w:sdt> blocks found")
 
-def sanitize_docx(input_path: str, output_path: str, mode: str = 'all') -> bool:
+    return parts
+
+
+def _read_document(zin: zipfile.ZipFile):
+    """Return word/document.xml from *zin*, or None (logged) if it is missing."""
+    try:
+        return zin.read('word/document.xml')
+    except KeyError:
+        log.error("No word/document.xml found")
+        return None
+
+
+@contextlib.contextmanager
+def open_docx(input_path: str):
+    """Open *input_path* as a (ZipFile, read-only mmap of the archive) pair."""
+    with open(input_path, 'rb') as f, zipfile.ZipFile(f) as zin, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as src:
+        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+            src.madvise(mmap.MADV_SEQUENTIAL)
+        yield zin, src
+
+
+def _temp_path_next_to(path: str) -> str:
+    """Create an empty temp file in *path*'s directory and return its path."""
+    input_dir = os.path.dirname(os.path.abspath(path)) or "."
+    temp_fd, temp_path = tempfile.mkstemp(
+        suffix=".docx",
+        prefix=".docx-sanitizer-",
+        dir=input_dir,
+    )
+    os.close(temp_fd)
+    return temp_path
+
+
+def sanitize_docx(input_path: str, output_path: str, mode: str = 'all',
+                  on_document=None) -> bool:
+    """Sanitize *input_path* into *output_path*.
+
+    When *output_path* is the input itself, the rewrite goes to a temp file
+    that atomically replaces the input once it is closed, and an input
+    needing no fixes is left untouched.
+
+    *on_document*, if given, is called with the word/document.xml bytes as
+    soon as they are read, so a caller can inspect them without opening the
+    input a second time.
+    """
+    temp_path = None
     try:
         input_size = os.path.getsize(input_path)
         log.info("Input: %s (%d bytes), mode: %s", input_path, input_size, mode)
+        in_place = (os.path.exists(output_path)
+                    and os.path.samefile(input_path, output_path))
 
-        with tempfile.TemporaryDirectory() as tmp:
-            with zipfile.ZipFile(input_path, 'r') as z:
-                tmp_abs = os.path.abspath(tmp)
-                for info in z.infolist():
-                    member_name = info.filename
-                    target_path = os.path.abspath(os.path.join(tmp, member_name))
-                    if not target_path.startswith(tmp_abs + os.sep):
-                        raise ValueError(f"Unsafe ZIP entry path: {member_name}")
-                    if info.is_dir():
-                        continue
-
-                    parent_dir = os.path.dirname(target_path)
-                    if parent_dir:
-                        os.makedirs(parent_dir, exist_ok=True)
-
-                    with z.open(info) as src, open(target_path, 'wb') as dst:
-                        shutil.copyfileobj(src, dst)
-
-            doc_path = os.path.join(tmp, 'word', 'document.xml')
-            if not os.path.exists(doc_path):
-                log.error("No word/document.xml found")
+        with open_docx(input_path) as (zin, src):
+            doc_data = _read_document(zin)
+            if doc_data is None:
                 return False
+            if on_document:
+                on_document(doc_data)
 
-            with open(doc_path, 'r', encoding='utf-8') as f:
-                doc_content = f.read()
-
-            doc_modified = False
-
-            # --- RTL compat fixes (glossary removal + compat mode downgrade) ---
-            if mode in ('rtl', 'all'):
-                remove_glossary(tmp)
-
-                if has_rtl_content(doc_content):
-                    log.info("RTL content detected — checking compatibilityMode")
-                    settings_path = os.path.join(tmp, 'word', 'settings.xml')
-                    if os.path.exists(settings_path):
-                        with open(settings_path, 'r', encoding='utf-8') as f:
-                            settings_content = f.read()
-                        new_settings, changed = downgrade_compat_mode(settings_content)
-                        if changed:
-                            with open(settings_path, 'w', encoding='utf-8') as f:
-                                f.write(new_settings)
-                            log.info("Downgraded compatibilityMode 15 → 14")
-                        else:
-                            log.info("compatibilityMode is not 15 — no change needed")
-                    else:
-                        log.info("No word/settings.xml found — skipping compat fix")
-                else:
-                    log.info("No RTL content detected — skipping compat downgrade")
-
-            # --- Header/footer NUMPAGES field fix ---
-            if mode == 'all':
-                nf_count = strip_numpages_fields_in_hf(tmp)
-                if nf_count:
-                    log.info("Stripped %d NUMPAGES field paragraph(s) from headers/footers",
-                             nf_count)
-                else:
-                    log.info("No NUMPAGES fields found in headers/footers")
-
-            # --- SDT unwrap ---
-            if mode in ('sdt', 'all'):
-                new_content, sdt_count = unwrap_sdt(doc_content)
-                if sdt_count:
-                    log.info("Unwrapped %d <w:sdt> block(s) (removed %d bytes)",
-                             sdt_count, len(doc_content) - len(new_content))
-                    doc_content = new_content
-                    doc_modified = True
+            parts = collect_fixes(zin, doc_data, mode)
+
+            if not parts:
+                if in_place:
+                    log.info("Nothing to fix — leaving input unchanged")
                 else:
-                    log.info("No <w:sdt> blocks found")
+                    log.info("Nothing to fix — copying input unchanged")
+                    shutil.copyfile(input_path, output_path)
+            else:
+                if in_place:
+                    temp_path = _temp_path_next_to(input_path)
+                repackage_docx(build_manifest(zin, parts), src,
+                               temp_path or output_path)
+
+        # Only replace the input after its archive and mapping are closed.
+        if temp_path:
+            os.replace(temp_path, input_path)
+            temp_path = None
+
+        output_size = os.path.getsize(output_path)
+        log.info("Output: %s (%d bytes, %+d)", output_path, output_size, output_size - input_size)
+        return True
+
+    except Exception as e:
+        log.exception("Error: %s", e)
+        return False
+
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def sanitize_stream(infile, outfile, mode: str = 'all') -> bool:
+    """Sanitize a DOCX read from binary stream *infile* into *outfile*.
+
+    Meant for stdin/stdout: the input is buffered in memory because zipfile
+    needs to seek in it, while the output is written without seeking.
+    """
+    try:
+        data = infile.read()
+        log.info("Input: <stream> (%d bytes), mode: %s", len(data), mode)
+
+        with zipfile.ZipFile(io.BytesIO(data)) as zin:
+            doc_data = _read_document(zin)
+            if doc_data is None:
+                return False
 
-            if doc_modified:
-                with open(doc_path, 'w', encoding='utf-8') as f:
-                    f.write(doc_content)
+            parts = collect_fixes(zin, doc_data, mode)
 
-            repackage_docx(tmp, output_path)
+            if parts:
+                repackage_docx(build_manifest(zin, parts), data, outfile)
+            else:
+                log.info("Nothing to fix — copying input unchanged")
+                outfile.write(data)
 
-            output_size = os.path.getsize(output_path)
-            log.info("Output: %s (%d bytes, %+d)", output_path, output_size, output_size - input_size)
-            return True
+        outfile.flush()
+        return True
 
     except Exception as e:
         log.exception("Error: %s", e)
@@ -308,18 +637,133 @@ def check_rtl(input_path: str) -> bool:
     """Open DOCX, read document.xml, return whether RTL content is present."""
     try:
         with zipfile.ZipFile(input_path, 'r') as z:
-            with z.open('word/document.xml') as f:
-                content = f.read().decode('utf-8')
-        return has_rtl_content(content)
+            doc_data = z.read('word/document.xml')
+        return has_rtl_content(doc_data)
     except (KeyError, Exception) as e:
         log.warning("Could not check RTL: %s", e)
         return False
 
 
+def sanitize_file(input_path: str, output_path: str = None, mode: str = 'all',
+                  **kwargs) -> bool:
+    """Sanitize *input_path* into *output_path*, or atomically in place if omitted.
+
+    Extra keyword arguments are passed through to sanitize_docx().
+    """
+    return sanitize_docx(input_path, output_path or input_path, mode=mode, **kwargs)
+
+
+def check_rtl_and_sanitize(input_path: str, output_path: str = None,
+                           mode: str = 'all') -> bool:
+    """Print RTL status like --check-rtl, then sanitize, opening the input once."""
+    reported = False
+
+    def report(doc_data):
+        nonlocal reported
+        print("true" if has_rtl_content(doc_data) else "false")
+        reported = True
+
+    ok = sanitize_file(input_path, output_path, mode=mode, on_document=report)
+    if not reported:
+        print("false")
+    return ok
+
+
+def _sanitize_job(job: tuple) -> bool:
+    input_path, output_path, mode = job
+    if not os.path.exists(input_path):
+        log.error("File not found: %s", input_path)
+        return False
+    return sanitize_file(input_path, output_path, mode=mode)
+
+
+def read_batch_list(path: str) -> list:
+    """Parse a batch list: one `input[<TAB>output]` pair per line, '-' for stdin."""
+    f = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    try:
+        pairs = []
+        for line in f:
+            line = line.rstrip('\r\n')
+            if not line.strip():
+                continue
+            input_path, _, output_path = line.partition('\t')
+            pairs.append((input_path, output_path or None))
+        return pairs
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def sanitize_batch(pairs: list, mode: str = 'all', jobs: int = None) -> bool:
+    """Sanitize (input, output) *pairs* in parallel worker processes.
+
+    Worker processes rather than threads, since the regex and deflate work is
+    CPU-bound and would serialize on the GIL.
+    """
+    ok = True
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(_sanitize_job,
+                               [(i, o, mode) for i, o in pairs])
+        for (input_path, output_path), success in zip(pairs, results):
+            if success:
+                print(f"Sanitized DOCX written to: {output_path or input_path}")
+            else:
+                log.error("Failed to sanitize: %s", input_path)
+                ok = False
+    return ok
+
+
+def _iter_null_delimited(stream):
+    """Yield NUL-terminated fields from binary *stream* as they arrive."""
+    pending = b''
+    while True:
+        chunk = stream.read1(65536)
+        if not chunk:
+            break
+        *fields, pending = (pending + chunk).split(b'\0')
+        yield from fields
+    if pending:
+        yield pending
+
+
+def serve(mode: str = 'all') -> bool:
+    """Sanitize `input\\0output\\0` path pairs read from stdin until EOF.
+
+    Keeps one warm interpreter for many files instead of paying process
+    startup per DOCX.  An empty output sanitizes the input in place.  Answers
+    each pair in order with an "ok" or "error" line on stdout.
+    """
+    ok = True
+    fields = _iter_null_delimited(sys.stdin.buffer)
+    for raw_input in fields:
+        raw_output = next(fields, None)
+        if raw_output is None:
+            log.error("Missing output path for: %s", os.fsdecode(raw_input))
+            print("error", flush=True)
+            return False
+
+        input_path = os.fsdecode(raw_input)
+        output_path = os.fsdecode(raw_output) or None
+        success = _sanitize_job((input_path, output_path, mode))
+        ok = ok and success
+        print("ok" if success else "error", flush=True)
+    return ok
+
+
+def _positive_int(value: str) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value!r}")
+    return number
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="DOCX sanitizer for LibreOffice conversion issues")
-    parser.add_argument("input", help="Input .docx file")
+    parser.add_argument("input", nargs="?", default=None, help="Input .docx file")
     parser.add_argument("output", nargs="?", default=None,
                         help="Output .docx (default: overwrite input)")
     parser.add_argument("-v", "--verbose", action="count", default=0)
@@ -329,8 +773,38 @@ def main():
     parser.add_argument("--check-rtl", action="store_true",
                         help="Check if document has RTL content and exit. "
                              "Prints 'true' or 'false' to stdout.")
+    parser.add_argument("--also-sanitize", action="store_true",
+                        help="With --check-rtl: sanitize after printing the "
+                             "RTL status instead of exiting, reading the "
+                             "input only once.")
+    runner = parser.add_mutually_exclusive_group()
+    runner.add_argument("--batch", metavar="FILE_LIST",
+                        help="Sanitize every file listed in FILE_LIST ('-' for "
+                             "stdin), one 'input[<TAB>output]' per line, in "
+                             "parallel. Files without an output are "
+                             "overwritten in place.")
+    runner.add_argument("--server", action="store_true",
+                        help="Read NUL-delimited 'input\\0output\\0' pairs from "
+                             "stdin until EOF and answer 'ok' or 'error' per "
+                             "pair on stdout. An empty output means in place.")
+    runner.add_argument("--stdio", action="store_true",
+                        help="Read a DOCX from stdin and write the sanitized "
+                             "DOCX to stdout.")
+    parser.add_argument("-j", "--jobs", type=_positive_int, default=None,
+                        help="Worker processes for --batch (default: CPU count)")
     args = parser.parse_args()
 
+    standalone = args.batch or args.server or args.stdio
+    if standalone and (args.input or args.check_rtl):
+        parser.error("--batch, --server and --stdio cannot be combined with "
+                     "an input file or --check-rtl")
+    if not standalone and not args.input:
+        parser.error("an input file is required")
+    if args.also_sanitize and not args.check_rtl:
+        parser.error("--also-sanitize requires --check-rtl")
+    if args.jobs is not None and not args.batch:
+        parser.error("-j/--jobs requires --batch")
+
     level = logging.WARNING
     if args.verbose >= 2:
         level = logging.DEBUG
@@ -339,48 +813,38 @@ def main():
     logging.basicConfig(level=level, format="%(levelname)-5s %(message)s",
                         stream=sys.stderr)
 
+    if args.batch:
+        try:
+            pairs = read_batch_list(args.batch)
+        except OSError as e:
+            log.error("Could not read batch list %s: %s", args.batch, e)
+            sys.exit(1)
+        sys.exit(0 if sanitize_batch(pairs, mode=args.mode, jobs=args.jobs) else 1)
+
+    if args.server:
+        sys.exit(0 if serve(mode=args.mode) else 1)
+
+    if args.stdio:
+        ok = sanitize_stream(sys.stdin.buffer, sys.stdout.buffer, mode=args.mode)
+        sys.exit(0 if ok else 1)
+
     if not os.path.exists(args.input):
         log.error("File not found: %s", args.input)
         sys.exit(1)
 
-    if args.check_rtl:
+    if args.check_rtl and not args.also_sanitize:
         print("true" if check_rtl(args.input) else "false")
         sys.exit(0)
 
     output = args.output or args.input
-    if output == args.input:
-        temp_fd = None
-        temp_path = None
-        try:
-            input_dir = os.path.dirname(os.path.abspath(args.input)) or "."
-            temp_fd, temp_path = tempfile.mkstemp(
-                suffix=".docx",
-                prefix=".docx-sanitizer-",
-                dir=input_dir,
-            )
-            os.close(temp_fd)
-            temp_fd = None
-
-            if sanitize_docx(args.input, temp_path, mode=args.mode):
-                os.replace(temp_path, args.input)
-                temp_path = None
-                print(f"Sanitized DOCX written to: {args.input}")
-            else:
-                if temp_path and os.path.exists(temp_path):
-                    os.remove(temp_path)
-                sys.exit(1)
-        except Exception as e:
-            if temp_fd is not None:
-                os.close(temp_fd)
-            if temp_path and os.path.exists(temp_path):
-                os.remove(temp_path)
-            log.exception("Error while sanitizing in place: %s", e)
-            sys.exit(1)
+    if args.check_rtl:
+        sanitized = check_rtl_and_sanitize(args.input, args.output, mode=args.mode)
     else:
-        if sanitize_docx(args.input, output, mode=args.mode):
-            print(f"Sanitized DOCX written to: {output}")
-        else:
-            sys.exit(1)
+        sanitized = sanitize_file(args.input, args.output, mode=args.mode)
+    if sanitized:
+        print(f"Sanitized DOCX written to: {output}")
+    else:
+        sys.exit(1)
 
 
 if __name__ == '__main__':